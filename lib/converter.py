@@ -1,6 +1,38 @@
 from abc import ABC, abstractmethod
 from time import time
-from typing import TextIO
+from typing import BinaryIO, ClassVar, Dict, Final, Type
+
+# RR data written after each blocked domain
+_CNAME_SUFFIX: Final = b' CNAME .\n'
+# first characters of lines to pass straight through, for RPZ files and for domain lists respectively
+_RPZ_PASSTHRU: Final = b';$@ '
+_DOMAIN_PASSTHRU: Final = b';#'
+# barebones zone file header for converted domain lists; the SOA serial is filled in each time a file is written
+_PREAMBLE_TEMPLATE: Final = b'''$TTL 2h
+@ IN SOA localhost. root.localhost. (%d 6h 1h 1w 2h)
+  IN NS  localhost.
+
+'''
+
+
+# Converter classes by name, for the command line.  Classes are added by register() and only instantiated once chosen.
+converters: Dict[str, Type['RpzConverter']] = {}
+
+
+def register(cls: Type['RpzConverter']) -> Type['RpzConverter']:
+    """
+    Make a converter available by its get_name().  The converters below are registered by calling this at the end of
+    the module.
+    """
+    converters[cls.get_name()] = cls
+    return cls
+
+
+def passthru_table(chars: bytes) -> bytes:
+    """
+    Build a 256-entry lookup table from a set of passthrough characters: byte i is 1 if i is one of them.
+    """
+    return bytes(1 if i in chars else 0 for i in range(256))
 
 
 class RpzConverter(ABC):
@@ -9,44 +41,50 @@ class RpzConverter(ABC):
     being read from the blocklist.
     """
 
+    # Lines beginning with any of these characters are passed straight to write_passthru without domain evaluation.
+    # The RpzProcessor indexes the equivalent table with the first byte of each line rather than calling a method
+    # for every line.
+    PASSTHRU_CHARS: ClassVar[bytes] = b''
+    PASSTHRU_TABLE: ClassVar[bytes] = passthru_table(PASSTHRU_CHARS)
+
     @abstractmethod
-    def before_writing(self, output: TextIO):
+    def before_writing(self, output: BinaryIO) -> None:
         """
         Called after the RPZ file has been opened for writing, but before any data has been written to the file.
         """
         pass
 
     @abstractmethod
-    def write_line(self, output: TextIO, line: str):
+    def write_line(self, output: BinaryIO, line: bytes) -> None:
         """
-        Called for every line that needs to be written to the RPZ file.
+        Called for every domain line that needs to be written to the RPZ file.
         """
         pass
 
-    @abstractmethod
-    def after_writing(self, output: TextIO):
+    def write_passthru(self, output: BinaryIO, line: bytes) -> None:
         """
-        Called once all the lines have been written, but the file is still open.  (Do not close the file here;
-        the RpzProcessor will handle that.)
+        Called for every line starting with one of the PASSTHRU_CHARS (directives, comments and so on).
         """
-        pass
+        output.write(line + b'\n')
 
     @abstractmethod
-    def should_passthru(self, line: str):
+    def after_writing(self, output: BinaryIO) -> None:
         """
-        Called once per line; return true if the line should be passed through, or false if it probably contains
-        a domain which should be evaluated
+        Called once all the lines have been written, but the file is still open.  (Do not close the file here;
+        the RpzProcessor will handle that.)
         """
+        pass
 
-    def extract_domain(self, line: str):
+    def extract_domain(self, line: bytes) -> bytes:
         """
         Given a line from the source file, extract just the domain from the line.
         """
-        return line.split()[0]
+        # split once only: the rest of the line is left whole rather than broken into fields which are thrown away
+        return line.split(None, 1)[0]
 
     @staticmethod
     @abstractmethod
-    def get_name():
+    def get_name() -> str:
         """
         Name for this converter, suitable for consumption as a command-line argument.
         """
@@ -57,22 +95,22 @@ class PassThruRpzConverter(RpzConverter):
     """
     Pass-through writer for files which are already in RPZ format.  Does nothing special.
     """
-    def before_writing(self, output: TextIO):
-        pass
 
-    def after_writing(self, output: TextIO):
+    # cheap & easy skip DNS directives and comments
+    PASSTHRU_CHARS: ClassVar[bytes] = _RPZ_PASSTHRU
+    PASSTHRU_TABLE: ClassVar[bytes] = passthru_table(PASSTHRU_CHARS)
+
+    def before_writing(self, output: BinaryIO) -> None:
         pass
 
-    def should_passthru(self, line: str):
-        # cheap & easy skip DNS directives and comments
-        return line[0] in (';', '$', '@', ' ')
+    def after_writing(self, output: BinaryIO) -> None:
+        pass
 
-    def write_line(self, output: TextIO, line: str):
-        output.write(line)
-        output.write('\n')
+    def write_line(self, output: BinaryIO, line: bytes) -> None:
+        output.write(line + b'\n')
 
     @staticmethod
-    def get_name():
+    def get_name() -> str:
         return 'rpz'
 
 
@@ -82,36 +120,28 @@ class DomainConverter(RpzConverter):
     header using the current epoch time as the serial number.
     """
 
-    PREAMBLE = f'''$TTL 2h
-@ IN SOA localhost. root.localhost. ({int(time())} 6h 1h 1w 2h)
-  IN NS  localhost.
-'''
+    PASSTHRU_CHARS: ClassVar[bytes] = _DOMAIN_PASSTHRU
+    PASSTHRU_TABLE: ClassVar[bytes] = passthru_table(PASSTHRU_CHARS)
 
-    def extract_domain(self, line: str):
+    def extract_domain(self, line: bytes) -> bytes:
         return line
 
-    def before_writing(self, output: TextIO):
-        output.write(DomainConverter.PREAMBLE)
-        output.write('\n')
+    def before_writing(self, output: BinaryIO) -> None:
+        # the serial is taken now rather than at import, so that it is current for every file written
+        output.write(_PREAMBLE_TEMPLATE % int(time()))
 
-    def after_writing(self, output: TextIO):
+    def after_writing(self, output: BinaryIO) -> None:
         pass
 
-    def should_passthru(self, line: str):
-        return line[0] in (';', '#')
+    def write_passthru(self, output: BinaryIO, line: bytes) -> None:
+        # passthrough lines start with either ';' or '#', and hashes become semicolons for RPZ
+        output.write(b';' + line[1:] + b'\n')
 
-    def write_line(self, output: TextIO, line: str):
-        # convert hashes to semicolons for RPZ
-        if line[0] == '#':  # Faster than line.startswith('#')
-            line = line.replace('#', ';', 1)  # Faster than ';' + line[1:]
-            output.write(line)
-            output.write('\n')
-        else:
-            output.write(line)
-            output.write(' CNAME .\n')
+    def write_line(self, output: BinaryIO, line: bytes) -> None:
+        output.write(line + _CNAME_SUFFIX)
 
     @staticmethod
-    def get_name():
+    def get_name() -> str:
         return 'domains'
 
 
@@ -125,33 +155,21 @@ class WildcardDomainConverter(DomainConverter):
     output both the wildcard line, and the bare domain line as well; ie, for `*.example.com`,
     RRs for both `*.example.com` and `example.com` will be written.
     """
-    def extract_domain(self, line: str):
-        return line[2:] if line[0:2] == '*.' else line
-
-    def write_line(self, output: TextIO, line: str):
-        # convert hashes to semicolons for RPZ
-        if line[0] == '#':  # Faster than line.startswith('#')
-            line = line.replace('#', ';', 1)  # Faster than ';' + line[1:]
-            output.write(line)
-            output.write('\n')
+    def extract_domain(self, line: bytes) -> bytes:
+        return line[2:] if line.startswith(b'*.') else line
+
+    def write_line(self, output: BinaryIO, line: bytes) -> None:
+        # For wildcard domains, also write out the bare domain for BIND.
+        if line.startswith(b'*.'):
+            output.write(line + _CNAME_SUFFIX + line[2:] + _CNAME_SUFFIX)
         else:
-            output.write(line)
-            output.write(' CNAME .\n')
-            # For wildcard domains, also write out the bare domain for BIND.
-            if line[0:2] == '*.':
-                output.write(line[2:])
-                output.write(' CNAME .\n')
+            output.write(line + _CNAME_SUFFIX)
 
     @staticmethod
-    def get_name():
+    def get_name() -> str:
         return 'wildcards'
 
 
-# Thanks for this really elegant solution, https://stackoverflow.com/a/33607093
-def all_subclasses(cls):
-    for subclass in cls.__subclasses__():
-        yield from all_subclasses(subclass)
-        yield subclass
-
-
-converters = {clazz.get_name(): clazz() for clazz in all_subclasses(RpzConverter)}
+register(PassThruRpzConverter)
+register(DomainConverter)
+register(WildcardDomainConverter)
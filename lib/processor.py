@@ -1,10 +1,84 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Collection, Dict, Final, Iterator, List, Optional, Set
+
 import requests
-from requests import HTTPError
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from converter import RpzConverter
 
+# nested dicts keyed on reversed domain labels, see RpzProcessor._add_right_match
+Trie = Dict[Optional[bytes], Any]
+
+# Use the Cython build of the import loop if it has been compiled (see setup.py), unless RPZ_CYTHON=False.
+do_import_core: Optional[Callable[..., None]] = None
+if os.environ.get('RPZ_CYTHON', 'True').lower() not in ('false', '0', 'no'):
+    try:
+        from processor_fast import do_import_core  # type: ignore[no-redef]
+    except ImportError:
+        pass
+
+# Optionally match right-hand allow-list entries with an Aho-Corasick automaton (pyahocorasick) instead of the trie.
+# It is opt-in with RPZ_AHOCORASICK=True because the trie walk stops at the first unknown label and is usually at
+# least as fast; the automaton is there for very large right-hand allow-lists.
+ahocorasick: Any = None
+if os.environ.get('RPZ_AHOCORASICK', 'False').lower() in ('true', '1', 'yes'):
+    try:
+        import ahocorasick  # type: ignore[no-redef]
+    except ImportError:
+        pass
 
-MAX_DOMAIN_LENGTH = 240
+# Optionally freeze the exact-match allow-list into a MARISA trie (marisa-trie) to save memory.  It is opt-in with
+# RPZ_MARISA=True because a trie lookup is several times slower than a set lookup, and there is one per domain line.
+marisa_trie: Any = None
+if os.environ.get('RPZ_MARISA', 'False').lower() in ('true', '1', 'yes'):
+    try:
+        import marisa_trie  # type: ignore[no-redef]
+    except ImportError:
+        pass
+
+
+MAX_DOMAIN_LENGTH: Final = 240
+DEFAULT_CHUNK_SIZE: Final = 1 << 20
+# most blocklists a single run will fetch in parallel (and HTTP connections kept per host)
+MAX_WORKERS: Final = 8
+USER_AGENT: Final = 'rpz_processor/1.0'
+
+
+def iter_response_lines(response: requests.Response, chunk_size: int,
+                        after_block: Optional[Callable[[], None]] = None) -> Iterator[bytes]:
+    """
+    Yield the lines of a streamed response as bytes, reading chunk_size bytes at a time.  Each chunk is cut at its
+    last newline so that the complete lines in it are split in one go, in C, rather than one line at a time.  RPZ
+    and domain lists are ASCII, so the lines are never decoded.
+
+    If given, after_block is called once the consumer has taken every line of a block, before the next is read.
+    """
+    pending = b''
+    for chunk in response.iter_content(chunk_size):
+        head, newline, pending = (pending + chunk).rpartition(b'\n')
+        if newline:
+            yield from head.splitlines()
+            if after_block is not None:
+                after_block()
+    if pending:
+        yield from pending.splitlines()
+
+
+def flush_output(fd: int, output: io.BytesIO) -> None:
+    """
+    Write everything buffered in output to the file descriptor fd, then empty the buffer.
+    """
+    with output.getbuffer() as view:
+        written = 0
+        while written < len(view):
+            with view[written:] as rest:
+                written += os.write(fd, rest)
+    output.seek(0)
+    output.truncate()
 
 
 class RpzProcessor:
@@ -13,14 +87,40 @@ class RpzProcessor:
     matching lines in that file, then writing the output to a local file.
     """
 
-    allow_domains_exact = set()
-    allow_domains_right = set()
-    converter = None
+    # a set, or a marisa_trie.BinaryTrie once frozen when RPZ_MARISA is enabled
+    allow_domains_exact: Collection[bytes]
+    allow_domains_right: Set[bytes]
+    # nested dicts keyed on reversed domain labels (as bytes); a None key marks the end of a right-hand match entry
+    right_trie: Trie
+    # built from allow_domains_right when RPZ_AHOCORASICK is enabled; used in place of right_trie
+    right_automaton: Any
+    converter: RpzConverter
+    chunk_size: int
+    session: requests.Session
 
-    def __init__(self, converter: RpzConverter):
+    def __init__(self, converter: RpzConverter, chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        """
+        :param converter: the converter used to write the RPZ file.
+        :param chunk_size: number of bytes to read from the network at a time while importing.
+        """
+        self.allow_domains_exact = set()
+        self.allow_domains_right = set()
+        self.right_trie = {}
+        self.right_automaton = None
         self.converter = converter
+        self.chunk_size = chunk_size
 
-    def read_allow_list(self, allow_list_file: str):
+        # one session for every import, so that lists fetched from the same host (or in parallel) reuse connections.
+        # Blocklists compress very well, so ask for compression explicitly; iter_content decodes it as it streams.
+        self.session = requests.Session()
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'User-Agent': USER_AGENT})
+        # raise_on_status=False hands the last 5xx response back so raise_for_status() reports it as an HTTPError
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def read_allow_list(self, allow_list_file: str) -> bool:
         """
         Read an allow-list file.  The format of this file is as follows:
 
@@ -38,81 +138,179 @@ class RpzProcessor:
         :param allow_list_file: the path to the file containing the Allow List.
         :return: True if reading the file was successful; false otherwise.
         """
+        exact = self.allow_domains_exact
+        if not isinstance(exact, set):  # thaw an allow-list frozen by an earlier call
+            exact = self.allow_domains_exact = set(exact)
+
         try:
-            with open(allow_list_file, 'r') as allow_list:
+            with open(allow_list_file, 'rb') as allow_list:
                 while line := allow_list.readline():
                     line = line.strip()
-                    if len(line) < 2 or line.startswith('#'):
+                    if len(line) < 2 or line.startswith(b'#'):
                         continue
-                    if line.startswith('.'):
+                    if line.startswith(b'.'):
                         line = line[1:]
-                        self.allow_domains_right.add(line)
-                        self.allow_domains_exact.add(line)
+                        self._add_right_match(line)
+                        exact.add(line)
                     else:
-                        self.allow_domains_exact.add(line)
+                        exact.add(line)
+            if ahocorasick is not None and self.allow_domains_right:
+                self._build_right_automaton()
+            if marisa_trie is not None:
+                self.allow_domains_exact = marisa_trie.BinaryTrie(exact)
             return True
         except OSError as e:
             print(f'Failed to read allow-list file {allow_list_file}: {e}')
         return False
 
-    def import_rpz_list(self, rpz_url: str, output_file: str):
+    def _add_right_match(self, domain: bytes) -> None:
+        """
+        Insert a right-hand match domain into the trie, one label at a time from right to left, so that
+        b'example.net' becomes {b'net': {b'example': {None: True}}}.  Bare top-level domains are never right-hand
+        matched, so they are left out of the trie.
+        """
+        if b'.' not in domain:
+            return
+        self.allow_domains_right.add(domain)
+        node: Trie = self.right_trie
+        for label in reversed(domain.split(b'.')):
+            node = node.setdefault(label, {})
+        node[None] = True
+
+    def _build_right_automaton(self) -> None:
+        """
+        Build an Aho-Corasick automaton over '.example.net' for every right-hand match domain.  A domain matches when
+        one of these patterns ends at the very end of '.' + domain.  pyahocorasick keys are str, so the ASCII domains
+        are decoded as latin-1, which cannot fail.
+        """
+        automaton = ahocorasick.Automaton()
+        for domain in self.allow_domains_right:
+            automaton.add_word('.' + domain.decode('latin-1'), True)
+        automaton.make_automaton()
+        self.right_automaton = automaton
+
+    def import_rpz_list(self, rpz_url: str, output_file: str) -> bool:
         try:
             self._do_import(rpz_url, output_file)
             return True
-        except HTTPError as e:
+        except RequestException as e:  # before OSError, which requests' exceptions subclass
             print(f'Failed to retrieve {rpz_url}: {e}')
         except OSError as e:
             print(f'Unable to open or write {output_file}: {e}')
 
         return False
 
-    def _do_import(self, rpz_url: str, output_file: str):
-        session = requests.Session()
+    def import_many(self, rpz_urls: List[str], output_files: List[str]) -> bool:
+        """
+        Import several RPZ lists concurrently, writing rpz_urls[i] to output_files[i].  The work is network-bound, so
+        each list gets its own thread.
+
+        :return: True if every list was imported successfully; false otherwise.
+        :raises ValueError: if rpz_urls and output_files are not the same length, or an output file is repeated.
+        """
+        if len(rpz_urls) != len(output_files):
+            raise ValueError(f'Got {len(rpz_urls)} URL(s) but {len(output_files)} output file(s)')
+        # concurrent imports into the same file would truncate and overwrite each other
+        if len({os.path.realpath(output_file) for output_file in output_files}) != len(output_files):
+            raise ValueError(f'Output files must all be different: {output_files}')
+        if not rpz_urls:
+            return True
+
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(rpz_urls))) as executor:
+            results = list(executor.map(self.import_rpz_list, rpz_urls, output_files))
+        return all(results)
 
-        with session.get(rpz_url, stream=True) as request:
+    def _do_import(self, rpz_url: str, output_file: str) -> None:
+        with self.session.get(rpz_url, stream=True) as request:
             request.raise_for_status()  # in case the response is not a 200
 
-            with open(output_file, 'w') as output:
+            # Converters write into an in-memory buffer, which is handed straight to the file descriptor after each
+            # block of input lines.  This skips the locking and bookkeeping of a buffered file object on every
+            # write, and the buffer never grows much beyond one chunk's worth of output.
+            fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            try:
+                output = io.BytesIO()
 
                 self.converter.before_writing(output)
 
-                for line in request.iter_lines(chunk_size=256, decode_unicode=True):
-                    if not line:  # skip blank lines
-                        continue
+                lines = iter_response_lines(request, self.chunk_size, lambda: flush_output(fd, output))
+                if do_import_core is not None:
+                    do_import_core(self.converter, self.allow_domains_exact, self.right_trie, self.right_automaton,
+                                   lines, output, MAX_DOMAIN_LENGTH)
+                else:
+                    self._import_lines(lines, output)
 
-                    if self.converter.should_passthru(line):
-                        self.converter.write_line(output, line)
-                        continue
+                self.converter.after_writing(output)
+                flush_output(fd, output)
+            finally:
+                os.close(fd)
 
-                    domain = self.converter.extract_domain(line)
+    def _import_lines(self, lines: Iterator[bytes], output: BinaryIO) -> None:
+        """
+        Pure-Python reference implementation of the per-line import loop.  processor_fast.do_import_core is the
+        compiled equivalent, so any change here must be made there as well.
+        """
+        # bind everything the loop touches to locals once, rather than looking up attributes for every line
+        passthru_table = self.converter.PASSTHRU_TABLE
+        extract_domain = self.converter.extract_domain
+        write_passthru = self.converter.write_passthru
+        write_line = self.converter.write_line
+        exact = self.allow_domains_exact
+        right_trie = self.right_trie
+        right_automaton = self.right_automaton
 
-                    # sometimes there's garbage in an RPZ file and the resulting domain name is > 255 characters long
-                    # including the base domain name (e.g., 'localhost').  This is a cheap attempt to ignore very long
-                    # domain names.
-                    if len(domain) > MAX_DOMAIN_LENGTH:
-                        continue
+        for line in lines:
+            if not line:  # skip blank lines
+                continue
 
-                    if domain in self.allow_domains_exact:
-                        continue
+            if passthru_table[line[0]]:
+                write_passthru(output, line)
+                continue
 
-                    # check for a right-hand match by decomposing the domain into successive subdomains and checking each
-                    # against the right-mand match set
-                    segments = domain.split('.')
-                    if len(segments) < 2:  # what nonsense is this?
-                        continue
+            domain = extract_domain(line)
 
-                    # decompose 'zot.foo.bar.baz' into [ 'zot.foo.bar.baz', 'foo.bar.baz', 'bar.baz' ]
-                    checklist = ['.'.join(segments[i:]) for i in range(len(segments) - 1)]
+            # sometimes there's garbage in an RPZ file and the resulting domain name is > 255 characters long
+            # including the base domain name (e.g., 'localhost').  This is a cheap attempt to ignore very long
+            # domain names.
+            end = len(domain)
+            if end > MAX_DOMAIN_LENGTH:
+                continue
 
-                    # check set membership.  This can be cheaper than any() if we get a match partway through the list
-                    found = False
-                    for item in checklist:
-                        if item in self.allow_domains_right:
-                            found = True
-                            break
-                    if found:
-                        continue
+            # discard single-label names before paying for any lookups
+            start = domain.rfind(b'.')
+            if start < 0:  # what nonsense is this?
+                continue
 
-                    # if we got here, there was no match, exact or right-hand.
-                    self.converter.write_line(output, line)
-                self.converter.after_writing(output)
+            if domain in exact:
+                continue
+
+            found = False
+            if right_automaton is not None:
+                # a right-hand match is a pattern which ends at the last character of '.' + domain
+                key = '.' + domain.decode('latin-1')
+                last = len(key) - 1
+                for match_end, _ in right_automaton.iter(key):
+                    if match_end == last:
+                        found = True
+                        break
+            else:
+                # walk the domain's labels from right to left through the trie.  Labels are sliced out one at a
+                # time with rfind, so nothing more is allocated once a label misses.
+                node: Trie = right_trie
+                while True:
+                    child = node.get(domain[start + 1:end])
+                    if child is None:
+                        break
+                    node = child
+                    if None in node:
+                        found = True
+                        break
+                    if start < 0:
+                        break
+                    end = start
+                    start = domain.rfind(b'.', 0, end)
+            if found:
+                continue
+
+            # if we got here, there was no match, exact or right-hand.
+            write_line(output, line)
@@ -0,0 +1,89 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Cython build of the per-line import loop from RpzProcessor._import_lines, which remains the pure-Python reference
+implementation.  Any change to the loop must be made in both places.
+"""
+
+
+cdef inline Py_ssize_t rfind_dot(const char* s, Py_ssize_t end):
+    """
+    Index of the last '.' in s[:end], or -1 if there isn't one.
+    """
+    end -= 1
+    while end >= 0 and s[end] != b'.':
+        end -= 1
+    return end
+
+
+def do_import_core(converter, allow_exact, dict right_trie, right_automaton, request_iter, output,
+                   Py_ssize_t max_domain_length):
+    """
+    Filter every line from request_iter against the allow-lists and write the survivors to output using converter,
+    skipping domains longer than max_domain_length.
+    allow_exact is a set, or a marisa_trie.BinaryTrie when RPZ_MARISA is enabled.  Right-hand matches use
+    right_automaton when it is not None, and right_trie otherwise.
+    """
+    cdef bytes line, domain
+    cdef Py_ssize_t start, end, last
+    cdef str key
+    cdef dict node
+    cdef object child
+    cdef bint found
+    # keep a reference to the table's bytes object so the pointer stays valid for the whole loop
+    cdef bytes passthru_bytes = converter.PASSTHRU_TABLE
+    cdef const unsigned char* passthru_table = passthru_bytes
+    extract_domain = converter.extract_domain
+    write_passthru = converter.write_passthru
+    write_line = converter.write_line
+
+    for line in request_iter:
+        if not line:  # skip blank lines
+            continue
+
+        if passthru_table[<unsigned char>line[0]]:
+            write_passthru(output, line)
+            continue
+
+        domain = extract_domain(line)
+
+        # cheap attempt to ignore garbage domain names, see RpzProcessor._import_lines
+        end = len(domain)
+        if end > max_domain_length:
+            continue
+
+        # discard single-label names before paying for any lookups
+        start = rfind_dot(domain, end)
+        if start < 0:
+            continue
+
+        if domain in allow_exact:
+            continue
+
+        found = False
+        if right_automaton is not None:
+            # a right-hand match is a pattern which ends at the last character of '.' + domain
+            key = '.' + domain.decode('latin-1')
+            last = len(key) - 1
+            for match_end, _ in right_automaton.iter(key):
+                if match_end == last:
+                    found = True
+                    break
+        else:
+            # walk the labels from right to left through the right-hand match trie
+            node = right_trie
+            while True:
+                child = node.get(domain[start + 1:end])
+                if child is None:
+                    break
+                node = <dict>child
+                if None in node:
+                    found = True
+                    break
+                if start < 0:
+                    break
+                end = start
+                start = rfind_dot(domain, end)
+        if found:
+            continue
+
+        write_line(output, line)
@@ -2,7 +2,7 @@
 import sys
 import os
 
-from converter import PassThruRpzConverter, converters
+from converter import PassThruRpzConverter, RpzConverter, converters
 from processor import RpzProcessor
 
 try:
@@ -21,19 +21,18 @@ minimum footprint.
 DEFAULT_URL = 'https://raw.githubusercontent.com/badmojr/1Hosts/master/Lite/rpz.txt'
 DEFAULT_OUTPUT_FILE = '/usr/local/etc/namedb/rpz.localhost'
 DEFAULT_ALLOW_LIST_FILE = '/usr/local/etc/namedb/rpz-allowlist'
-MAX_DOMAIN_LENGTH = 240
 
 
-def converter_choice(choice: str):
+def converter_choice(choice: str) -> RpzConverter:
     try:
-        return converters[choice]
+        return converters[choice]()
     except KeyError:
         raise AttributeError(f'Bad converter value {choice}, valid choices are {converters.keys()}')
 
 
 # Give the user meaningful feedback if the script is being run as root without -U, or if the script has been
 # run with -U, but setuid support is not available on this platform.
-def check_suid(username: str):
+def check_suid(username: str) -> None:
     try:
         uid = os.getuid()
         if uid == 0:
@@ -63,16 +62,17 @@ if __name__ == '__main__':
                         nargs='?',
                         type=str,
                         help='Path to the allow-list file. Use `-` for no allow-list.')
+    # -u and -o extend rather than replace, so both `-u A B` and `-u A -u B` work; defaults are filled in after parsing
     parser.add_argument('-u', metavar='URL',
-                        default=DEFAULT_URL,
-                        nargs='?',
+                        action='extend',
+                        nargs='+',
                         type=parse.urlparse,
-                        help='URL pointing to an RPZ file to import.')
+                        help='URL(s) pointing to RPZ files to import.  Several lists are fetched concurrently.')
     parser.add_argument('-o', metavar='file',
-                        default=DEFAULT_OUTPUT_FILE,
-                        nargs='?',
+                        action='extend',
+                        nargs='+',
                         type=str,
-                        help='Path to the output file containing the filtered RPZ file.')
+                        help='Path(s) to the output files containing the filtered RPZ files, one for each URL.')
     parser.add_argument('-c', metavar='converter',
                         default=PassThruRpzConverter.get_name(),
                         nargs='?',
@@ -88,13 +88,26 @@ if __name__ == '__main__':
 
     check_suid(args.U)
 
+    if args.u is None:
+        args.u = [parse.urlparse(DEFAULT_URL)]
+    if args.o is None:
+        args.o = [DEFAULT_OUTPUT_FILE]
+
+    urls = [url.geturl() for url in args.u]
+    if len(urls) != len(args.o):
+        print(f'Got {len(urls)} URL(s) but {len(args.o)} output file(s); please give one output file for each URL.')
+        exit(1)
+    if len({os.path.realpath(output_file) for output_file in args.o}) != len(args.o):
+        print(f'The same output file was given more than once in {args.o}; please give a different one for each URL.')
+        exit(1)
+
     processor = RpzProcessor(converter_choice(args.c))
 
     if args.a != '-':
         if not processor.read_allow_list(args.a):
             exit(1)
 
-    url = args.u.geturl()
-    print(f'Fetching {url}, applying {len(processor.allow_domains_exact)} allow-list entries,\n'
-          f'and writing to {args.o} using converter `{args.c}`')
-    exit(0 if processor.import_rpz_list(url, args.o) else 1)
+    for url, output_file in zip(urls, args.o):
+        print(f'Fetching {url}, applying {len(processor.allow_domains_exact)} allow-list entries,\n'
+              f'and writing to {output_file} using converter `{args.c}`')
+    exit(0 if processor.import_many(urls, args.o) else 1)
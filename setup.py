@@ -0,0 +1,38 @@
+import os
+import sys
+
+from setuptools import setup
+
+
+def env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() not in ('false', '0', 'no')
+
+
+# Build script for the optional native extensions only, placed next to the sources in lib/ with
+# `python setup.py build_ext --inplace`; it does not install anything.  Without Cython (or with RPZ_CYTHON=False)
+# processor.py falls back to its own implementation of the import loop, and without RPZ_MYPYC=True converter.py and
+# processor.py simply run as plain Python.  Anything else, including `pip install .`, is refused: installing would
+# put modules with generic names (converter, processor, processor_fast) at the top level of site-packages.
+args = sys.argv[1:]
+if 'build_ext' not in args or not {'--inplace', '-i'} & set(args):
+    sys.exit('setup.py only builds the optional extensions in place: python setup.py build_ext --inplace')
+
+ext_modules = []
+if env_flag('RPZ_CYTHON', 'True'):
+    try:
+        from Cython.Build import cythonize
+        ext_modules += cythonize('lib/processor_fast.pyx')
+    except ImportError:
+        pass
+
+if env_flag('RPZ_MYPYC', 'False'):
+    from mypyc.build import mypycify
+    ext_modules += mypycify(['--ignore-missing-imports', 'lib/converter.py', 'lib/processor.py'])
+
+setup(
+    name='rpz_processor',
+    version='1.0',
+    description='Straightforward Response Policy Zone processor with allow-listing',
+    package_dir={'': 'lib'},
+    ext_modules=ext_modules,
+)